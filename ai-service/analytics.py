@@ -2,17 +2,48 @@
 ODAN AI Service - Ticket analytics aggregation and CARTO export.
 """
 
+import asyncio
 import logging
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 
+import asyncpg
 import httpx
+import orjson
+from cachetools import TTLCache
 
 from config import Settings
 
 logger = logging.getLogger(__name__)
 
+# One row per hour of the day (zero-filled), so no gap filling is needed in Python.
+# The createdAt bound is a plain timestamptz expression, so the Ticket createdAt
+# index (see backend/prisma/schema.prisma) can serve it as a range scan.
+HOURLY_TICKET_COUNTS_QUERY = """
+    SELECT h.hour, COALESCE(t.count, 0)::int AS count
+    FROM generate_series(0, 23) AS h(hour)
+    LEFT JOIN (
+        SELECT EXTRACT(HOUR FROM ("createdAt" AT TIME ZONE $1))::int AS hour,
+               COUNT(*)::int AS count
+        FROM "Ticket"
+        WHERE "createdAt" >= NOW() - make_interval(days => $2)
+        GROUP BY hour
+    ) AS t USING (hour)
+    ORDER BY h.hour
+"""
+
+# Short-lived cache so the scheduler and API pollers share one query per minute
+HOURLY_CACHE_TTL_SECONDS = 60
+_hourly_cache: TTLCache = TTLCache(maxsize=8, ttl=HOURLY_CACHE_TTL_SECONDS)
+_hourly_cache_lock = asyncio.Lock()
+
+
+@lru_cache(maxsize=8)
+def _tz(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
 
 @dataclass(frozen=True)
 class HourlyBucket:
@@ -20,34 +51,45 @@ class HourlyBucket:
     count: int
 
 
-async def fetch_hourly_ticket_counts(settings: Settings) -> list[HourlyBucket]:
-    if not settings.database_url:
+async def fetch_hourly_ticket_counts(settings: Settings, pool: asyncpg.Pool | None) -> list[HourlyBucket]:
+    if pool is None:
         raise RuntimeError("Database URL not configured for analytics")
 
-    import asyncpg
+    tz = _tz(settings.ticket_stats_timezone)
 
-    tz = ZoneInfo(settings.ticket_stats_timezone)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(HOURLY_TICKET_COUNTS_QUERY, tz.key, settings.ticket_stats_window_days)
 
-    query = """
-        SELECT EXTRACT(HOUR FROM ("createdAt" AT TIME ZONE $1))::int AS hour,
-               COUNT(*)::int AS count
-        FROM "Ticket"
-        WHERE "createdAt" >= NOW() - ($2 || ' days')::interval
-        GROUP BY hour
-        ORDER BY hour
-    """
+    return [HourlyBucket(hour=hour, count=count) for hour, count in rows]
+
+
+async def fetch_cached_hourly_ticket_counts(
+    settings: Settings,
+    pool: asyncpg.Pool | None,
+) -> list[HourlyBucket]:
+    key = (settings.ticket_stats_window_days, settings.ticket_stats_timezone)
+    buckets = _hourly_cache.get(key)
+    if buckets is not None:
+        return buckets
+
+    # Only one caller refreshes an expired entry; the rest wait and reuse it
+    async with _hourly_cache_lock:
+        buckets = _hourly_cache.get(key)
+        if buckets is None:
+            buckets = await fetch_hourly_ticket_counts(settings, pool)
+            _hourly_cache[key] = buckets
+    return buckets
 
-    conn = await asyncpg.connect(settings.database_url)
-    try:
-        rows = await conn.fetch(query, str(tz), settings.ticket_stats_window_days)
-    finally:
-        await conn.close()
 
-    counts_by_hour = {row["hour"]: row["count"] for row in rows}
-    return [HourlyBucket(hour=hour, count=counts_by_hour.get(hour, 0)) for hour in range(24)]
+def clear_hourly_ticket_cache() -> None:
+    _hourly_cache.clear()
 
 
-async def send_hourly_stats_to_carto(settings: Settings, buckets: list[HourlyBucket]) -> None:
+async def send_hourly_stats_to_carto(
+    settings: Settings,
+    buckets: list[HourlyBucket],
+    client: httpx.AsyncClient,
+) -> None:
     if not settings.carto_api_url:
         logger.info("CARTO API URL not configured; skipping export.")
         return
@@ -63,7 +105,6 @@ async def send_hourly_stats_to_carto(settings: Settings, buckets: list[HourlyBuc
     if settings.carto_api_key:
         headers["Authorization"] = f"Bearer {settings.carto_api_key}"
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        response = await client.post(settings.carto_api_url, json=payload, headers=headers)
-        response.raise_for_status()
-        logger.info("Sent hourly ticket stats to CARTO.")
+    response = await client.post(settings.carto_api_url, content=orjson.dumps(payload), headers=headers)
+    response.raise_for_status()
+    logger.info("Sent hourly ticket stats to CARTO.")
@@ -0,0 +1,100 @@
+"""
+ODAN AI Service - Micro-batching for local model inference
+"""
+
+import asyncio
+import contextlib
+import logging
+from typing import Callable, Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Coalesce concurrent single-item requests into one batched call.
+
+    Items submitted within ``max_wait_ms`` of the first queued item (up to
+    ``max_batch`` of them) are passed together to ``process``, which runs in a
+    worker thread and must return one result per input, in input order.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[list[T]], list[R]],
+        max_batch: int = 16,
+        max_wait_ms: float = 10.0,
+    ):
+        self._process = process
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the background worker on the running loop (idempotent)"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the worker and cancel anything still waiting"""
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._worker
+
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+        self._worker = None
+        self._queue = None
+
+    async def submit(self, item: T) -> R:
+        """Queue one item and wait for its result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _collect(self) -> list[tuple[T, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self._max_wait
+
+        while len(batch) < self._max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Callers that gave up while queued don't need a slot in the batch
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            try:
+                results = await asyncio.to_thread(self._process, [item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"Batched inference failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -7,6 +7,10 @@ from pydantic import AliasChoices, Field, field_validator
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 
+# Every worker holds its own copy of the local models, so the automatic
+# worker count is bounded when they are loaded
+MAX_AUTO_WORKERS_WITH_LOCAL_MODELS = 2
+
 
 class Settings(BaseSettings):
     """Application settings"""
@@ -15,6 +19,13 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = False
+    # Uvicorn worker processes; None means one per CPU, capped at
+    # MAX_AUTO_WORKERS_WITH_LOCAL_MODELS when local fallback is enabled
+    # (forced to 1 in debug). Each worker loads its own copy of the local models.
+    workers: int | None = Field(
+        default=None,
+        validation_alias=AliasChoices("AI_SERVICE_WORKERS")
+    )
     
     # HuggingFace
     huggingface_api_token: str | None = None
@@ -24,10 +35,28 @@ class Settings(BaseSettings):
     use_local_fallback: bool = True
     models_dir: str = "./models"
     
-    # Model Names
+    # FP16 weights on GPU, dynamic INT8 Linear layers on CPUs with VNNI
+    quantize_local_models: bool = True
+    
+    # Intra-op threads per worker for local inference; None splits the CPUs
+    # evenly across workers so they don't oversubscribe cores
+    inference_threads: int | None = None
+    
+    # Model Names (Hub ids or local directories; a local text model directory
+    # holding model.onnx / model_quantized.onnx is served with ONNX Runtime)
     text_nsfw_model: str = "eliasalbouzidi/distilbert-nsfw-text-classifier"
     text_offensive_model: str = "Falconsai/offensive_speech_detection"
     image_nsfw_model: str = "Falconsai/nsfw_image_detection"
+    # Optional single multi-label text classifier (sigmoid heads such as
+    # nsfw/offensive/hate/toxic); when set it replaces both text models above
+    # with one forward pass / one API call per text
+    text_multilabel_model: str | None = None
+    
+    # Lexicon prefilter: short texts with no lexicon hit skip the models,
+    # guaranteed-unsafe ("!"-prefixed) terms are rejected outright.
+    # Disabled unless a lexicon file is configured.
+    text_prefilter_lexicon: str | None = None
+    text_prefilter_max_safe_length: int = 200
     
     # Thresholds
     nsfw_threshold: float = 0.7
@@ -35,6 +64,8 @@ class Settings(BaseSettings):
     
     # Rate Limiting
     api_rate_limit_per_minute: int = 60
+    # Largest /moderate/text request body accepted (only 2000 chars are moderated)
+    max_input_bytes: int = 65_536
 
     # CORS
     allowed_origins: list[str] = Field(
@@ -83,13 +114,40 @@ class Settings(BaseSettings):
         if isinstance(value, list):
             return value
         return [origin.strip() for origin in str(value).split(",") if origin.strip()]
+
+    @field_validator("workers", "inference_threads", mode="before")
+    @classmethod
+    def blank_to_none(cls, value):
+        if isinstance(value, str) and not value.strip():
+            return None
+        return value
     
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
 
-@lru_cache()
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     """Get cached settings instance"""
     return Settings()
+
+
+def get_worker_count(settings: Settings) -> int:
+    """Uvicorn worker processes to run"""
+    if settings.debug:
+        return 1
+    if settings.workers:
+        return settings.workers
+    cpus = os.cpu_count() or 1
+    if settings.use_local_fallback:
+        return min(cpus, MAX_AUTO_WORKERS_WITH_LOCAL_MODELS)
+    return cpus
+
+
+def get_inference_threads(settings: Settings) -> int:
+    """Intra-op thread count for one worker process"""
+    if settings.inference_threads:
+        return settings.inference_threads
+    cpus = os.cpu_count() or 1
+    return max(1, cpus // get_worker_count(settings))
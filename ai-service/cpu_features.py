@@ -0,0 +1,25 @@
+"""
+ODAN AI Service - CPU feature detection for local inference
+"""
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _cpu_flags() -> str:
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            return cpuinfo.read()
+    except OSError:
+        return ""
+
+
+def cpu_supports_vnni() -> bool:
+    """INT8 matmuls only pay off on CPUs with VNNI dot-product instructions"""
+    flags = _cpu_flags()
+    return "avx512_vnni" in flags or "avx_vnni" in flags
+
+
+def cpu_supports_amx_bf16() -> bool:
+    """AMX tiles (Sapphire Rapids and later) run BF16 GEMMs far faster than FP32"""
+    return "amx_bf16" in _cpu_flags()
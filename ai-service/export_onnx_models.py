@@ -0,0 +1,65 @@
+"""
+ODAN AI Service - Export text classifiers to ONNX with INT8 dynamic quantization
+
+Run once at image build time (or by hand) to let CPU hosts serve the text
+models through ONNX Runtime instead of FP32 PyTorch:
+
+    python export_onnx_models.py
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+from optimum.exporters.onnx import main_export
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from onnxruntime.transformers import optimizer
+
+from config import get_settings
+from text_moderation import onnx_model_dir
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Attention/LayerNorm/GELU fusion patterns need opset >= 13
+ONNX_OPSET = 14
+
+
+def export_text_model(model_name: str) -> Path:
+    """Export one HuggingFace classifier, fuse its graph and write an INT8 copy"""
+    output_dir = onnx_model_dir(model_name)
+    model_path = output_dir / "model.onnx"
+    logger.info(f"Exporting {model_name} to {output_dir}")
+    main_export(model_name, output=output_dir, task="text-classification", opset=ONNX_OPSET)
+
+    # Fuse attention, LayerNorm and GELU subgraphs into single kernels.
+    # num_heads/hidden_size=0 lets the optimizer read them from the graph.
+    optimized = optimizer.optimize_model(
+        str(model_path),
+        model_type="bert",
+        num_heads=0,
+        hidden_size=0
+    )
+    optimized.save_model_to_file(str(model_path))
+
+    # Dynamic INT8 needs no calibration data; picked at load time on VNNI CPUs
+    quantize_dynamic(
+        output_dir / "model.onnx",
+        output_dir / "model_quantized.onnx",
+        weight_type=QuantType.QInt8
+    )
+    return output_dir
+
+
+if __name__ == "__main__":
+    names = [settings.text_nsfw_model, settings.text_offensive_model]
+    if settings.text_multilabel_model:
+        names.append(settings.text_multilabel_model)
+    for name in names:
+        export_text_model(name)
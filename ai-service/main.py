@@ -4,20 +4,43 @@ ODAN AI Service - Main Application
 
 import asyncio
 import contextlib
+import fcntl
 import logging
+import os
 import sys
+import tempfile
 from contextlib import asynccontextmanager
+from typing import Any
 
+import asyncpg
+import httpx
+import msgspec
 import uvicorn
-from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi import FastAPI, File, Header, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 
-from analytics import fetch_hourly_ticket_counts, send_hourly_stats_to_carto
-from config import get_settings
-from text_moderation import moderate_text
-from image_moderation import moderate_image
+from analytics import (
+    clear_hourly_ticket_cache,
+    fetch_cached_hourly_ticket_counts,
+    send_hourly_stats_to_carto,
+)
+from config import get_settings, get_worker_count
+from text_moderation import (
+    ModerationResult,
+    clear_verdict_cache,
+    configure_torch_threads,
+    moderate_text,
+    text_batcher,
+    warmup_text_models,
+)
+from image_moderation import (
+    image_batcher,
+    load_image_nsfw_model,
+    moderate_image,
+    moderate_image_bytes,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -29,16 +52,62 @@ logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
+# Outbound keep-alive pool size; also caps concurrent HuggingFace API calls
+HTTP_MAX_KEEPALIVE = 20
 
-# Request/Response Models
-class TextModerationRequest(BaseModel):
+
+# Request Models (msgspec: decoded and validated straight from the raw body)
+class TextModerationRequest(msgspec.Struct):
     text: str
 
 
-class ImageModerationRequest(BaseModel):
+class ImageModerationRequest(msgspec.Struct):
     imageBase64: str
 
 
+class BatchModerationItem(msgspec.Struct):
+    id: Any = None
+    type: str | None = None
+    content: str = ""
+
+
+class BatchModerationRequest(msgspec.Struct):
+    items: list[BatchModerationItem] = []
+
+
+_text_request_decoder = msgspec.json.Decoder(TextModerationRequest)
+_image_request_decoder = msgspec.json.Decoder(ImageModerationRequest)
+_batch_request_decoder = msgspec.json.Decoder(BatchModerationRequest)
+_response_encoder = msgspec.json.Encoder()
+
+
+def json_request_body(struct: type) -> dict:
+    """
+    OpenAPI requestBody for a msgspec-decoded JSON body
+
+    Handlers that read the raw Request get no body schema from FastAPI, so it
+    is generated from the struct (nested definitions inlined).
+    """
+    (schema,), definitions = msgspec.json.schema_components([struct])
+
+    def inline(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return inline(definitions[node["$ref"].rsplit("/", 1)[-1]])
+            return {key: inline(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [inline(value) for value in node]
+        return node
+
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": inline(schema)}},
+        }
+    }
+
+
+# Response Models
 class ModerationResponse(BaseModel):
     isSafe: bool
     confidence: float
@@ -73,9 +142,42 @@ async def lifespan(app: FastAPI):
     logger.info(f"HuggingFace API: {'configured' if settings.huggingface_api_token else 'not configured'}")
     logger.info(f"Local fallback: {'enabled' if settings.use_local_fallback else 'disabled'}")
 
+    # Shared outbound HTTP client (keep-alive pool for CARTO and HuggingFace).
+    # HTTP/2 lets concurrent HuggingFace calls multiplex over one connection.
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=15,
+        limits=httpx.Limits(max_keepalive_connections=HTTP_MAX_KEEPALIVE, max_connections=100),
+    )
+    # Backpressure: if HuggingFace slows down, queue here instead of piling up sockets
+    app.state.hf_semaphore = asyncio.Semaphore(HTTP_MAX_KEEPALIVE)
+
+    # Pay model download/load and warm-up at startup, not on the first request
+    if settings.use_local_fallback:
+        configure_torch_threads()
+        await asyncio.to_thread(load_image_nsfw_model)
+        await asyncio.to_thread(warmup_text_models)
+
+    # Coalesce concurrent local inferences into batched forward passes
+    image_batcher.start()
+    text_batcher.start()
+
+    # Bounds concurrent work fanned out by /moderate/batch
+    app.state.batch_semaphore = asyncio.Semaphore(settings.api_rate_limit_per_minute // 60 + 5)
+
+    # Analytics connection pool; min_size=0 so a database outage never blocks startup
+    app.state.pg = None
+    if settings.database_url:
+        app.state.pg = await asyncpg.create_pool(
+            settings.database_url,
+            min_size=0,
+            max_size=10,
+            statement_cache_size=100,
+        )
+
     analytics_task = None
     if settings.carto_api_url:
-        analytics_task = asyncio.create_task(schedule_carto_exports())
+        analytics_task = asyncio.create_task(schedule_carto_exports(app.state.http, app.state.pg))
     
     yield
 
@@ -83,6 +185,14 @@ async def lifespan(app: FastAPI):
         analytics_task.cancel()
         with contextlib.suppress(asyncio.CancelledError):
             await analytics_task
+
+    await image_batcher.stop()
+    await text_batcher.stop()
+    clear_hourly_ticket_cache()
+    clear_verdict_cache()
+    if app.state.pg is not None:
+        await app.state.pg.close()
+    await app.state.http.aclose()
     
     logger.info("👋 Shutting down ODAN AI Service...")
 
@@ -92,6 +202,7 @@ app = FastAPI(
     title="ODAN AI Service",
     description="AI-powered content moderation for ODAN platform",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -109,7 +220,7 @@ app.add_middleware(
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled error: {exc}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "isSafe": True,  # Default to safe on error to avoid blocking
@@ -119,6 +230,40 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 
+async def read_body_capped(request: Request, max_bytes: int) -> bytes:
+    """Read the body chunk by chunk, 413 as soon as it exceeds max_bytes"""
+    chunks = []
+    size = 0
+    # Chunked uploads carry no Content-Length, so count while streaming
+    # rather than buffering the whole body first
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail="Request body too large")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def decode_body(
+    request: Request,
+    decoder: msgspec.json.Decoder,
+    max_bytes: int | None = None,
+):
+    """Decode and validate a JSON request body, 413 if too large, 422 on bad input"""
+    if max_bytes is not None:
+        # Reject on the declared size before reading anything
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            raise HTTPException(status_code=413, detail="Request body too large")
+
+    body = await request.body() if max_bytes is None else await read_body_capped(request, max_bytes)
+
+    try:
+        return decoder.decode(body)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
 # Routes
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -129,6 +274,8 @@ async def health_check():
         "models": {
             "text_nsfw": settings.text_nsfw_model,
             "text_offensive": settings.text_offensive_model,
+            # When set, this single model serves text moderation instead of the two above
+            "text_multilabel": settings.text_multilabel_model,
             "image_nsfw": settings.image_nsfw_model,
         },
         "analytics": {
@@ -140,25 +287,43 @@ async def health_check():
     }
 
 
-async def schedule_carto_exports() -> None:
-    while True:
-        try:
-            buckets = await fetch_hourly_ticket_counts(settings)
-            await send_hourly_stats_to_carto(settings, buckets)
-        except Exception as exc:
-            logger.error("Failed to export hourly ticket stats to CARTO", exc_info=exc)
-        await asyncio.sleep(settings.carto_send_interval_minutes * 60)
+CARTO_EXPORT_LOCK_PATH = os.path.join(tempfile.gettempdir(), "odan-carto-export.lock")
+
+
+def try_acquire_export_lock(lock_file) -> bool:
+    """Non-blocking exclusive lock; released automatically when the process exits"""
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+async def schedule_carto_exports(client: httpx.AsyncClient, pool: asyncpg.Pool | None) -> None:
+    # Every uvicorn worker runs this loop; only the lock holder exports
+    with open(CARTO_EXPORT_LOCK_PATH, "w") as lock_file:
+        while True:
+            if try_acquire_export_lock(lock_file):
+                try:
+                    buckets = await fetch_cached_hourly_ticket_counts(settings, pool)
+                    await send_hourly_stats_to_carto(settings, buckets, client)
+                except Exception as exc:
+                    logger.error("Failed to export hourly ticket stats to CARTO", exc_info=exc)
+            await asyncio.sleep(settings.carto_send_interval_minutes * 60)
 
 
 @app.get("/analytics/tickets/hourly", response_model=HourlyTicketStatsResponse)
-async def hourly_ticket_stats(x_analytics_key: str | None = Header(default=None, alias="X-Analytics-Key")):
+async def hourly_ticket_stats(
+    request: Request,
+    x_analytics_key: str | None = Header(default=None, alias="X-Analytics-Key"),
+):
     if settings.analytics_api_key and x_analytics_key != settings.analytics_api_key:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     if not settings.database_url:
         raise HTTPException(status_code=503, detail="Analytics database not configured")
 
-    buckets = await fetch_hourly_ticket_counts(settings)
+    buckets = await fetch_cached_hourly_ticket_counts(settings, request.app.state.pg)
     return {
         "windowDays": settings.ticket_stats_window_days,
         "timezone": settings.ticket_stats_timezone,
@@ -166,8 +331,12 @@ async def hourly_ticket_stats(x_analytics_key: str | None = Header(default=None,
     }
 
 
-@app.post("/moderate/text", response_model=ModerationResponse)
-async def moderate_text_endpoint(request: TextModerationRequest):
+@app.post(
+    "/moderate/text",
+    response_model=ModerationResponse,
+    openapi_extra=json_request_body(TextModerationRequest),
+)
+async def moderate_text_endpoint(request: Request):
     """
     Moderate text content
     
@@ -175,12 +344,47 @@ async def moderate_text_endpoint(request: TextModerationRequest):
     - NSFW content
     - Offensive/hateful speech
     """
+    payload = await decode_body(request, _text_request_decoder, settings.max_input_bytes)
     try:
-        result = await moderate_text(request.text)
-        return ModerationResponse(**result)
+        result = await moderate_text(
+            payload.text, request.app.state.http, request.app.state.hf_semaphore
+        )
     except Exception as e:
         logger.error(f"Text moderation failed: {e}")
         # Default to safe on error
+        result = ModerationResult(
+            isSafe=True,
+            confidence=0.0,
+            reason=f"Moderation error: {str(e)}"
+        )
+    # Encoded straight from the struct; no intermediate dict or pydantic model
+    return Response(content=_response_encoder.encode(result), media_type="application/json")
+
+
+@app.post(
+    "/moderate/image",
+    response_model=ModerationResponse,
+    deprecated=True,
+    openapi_extra=json_request_body(ImageModerationRequest),
+)
+async def moderate_image_endpoint(request: Request):
+    """
+    Moderate image content (base64 JSON body)
+    
+    Checks for:
+    - NSFW/explicit imagery
+    
+    Deprecated: prefer /moderate/image/raw, which avoids the base64 overhead.
+    """
+    payload = await decode_body(request, _image_request_decoder)
+    try:
+        result = await moderate_image(
+            payload.imageBase64, request.app.state.http, request.app.state.hf_semaphore
+        )
+        return ModerationResponse(**result)
+    except Exception as e:
+        logger.error(f"Image moderation failed: {e}")
+        # Default to safe on error
         return ModerationResponse(
             isSafe=True,
             confidence=0.0,
@@ -188,16 +392,19 @@ async def moderate_text_endpoint(request: TextModerationRequest):
         )
 
 
-@app.post("/moderate/image", response_model=ModerationResponse)
-async def moderate_image_endpoint(request: ImageModerationRequest):
+@app.post("/moderate/image/raw", response_model=ModerationResponse)
+async def moderate_image_raw_endpoint(request: Request, file: UploadFile = File(...)):
     """
-    Moderate image content
+    Moderate image content (multipart/form-data upload)
     
     Checks for:
     - NSFW/explicit imagery
     """
     try:
-        result = await moderate_image(request.imageBase64)
+        image_bytes = await file.read()
+        result = await moderate_image_bytes(
+            image_bytes, request.app.state.http, request.app.state.hf_semaphore
+        )
         return ModerationResponse(**result)
     except Exception as e:
         logger.error(f"Image moderation failed: {e}")
@@ -209,27 +416,56 @@ async def moderate_image_endpoint(request: ImageModerationRequest):
         )
 
 
-@app.post("/moderate/batch")
+async def moderate_batch_item(
+    item: BatchModerationItem,
+    client: httpx.AsyncClient,
+    hf_semaphore: asyncio.Semaphore,
+) -> dict:
+    """Moderate a single batch item"""
+    if item.type == "text":
+        result = await moderate_text(item.content, client, hf_semaphore)
+    elif item.type == "image":
+        result = await moderate_image(item.content, client, hf_semaphore)
+    else:
+        result = {"isSafe": True, "confidence": 0.0, "reason": "Unknown type"}
+
+    return {
+        "id": item.id,
+        **msgspec.to_builtins(result)
+    }
+
+
+@app.post("/moderate/batch", openapi_extra=json_request_body(BatchModerationRequest))
 async def moderate_batch_endpoint(request: Request):
     """
     Batch moderation for multiple items
     """
+    body = await decode_body(request, _batch_request_decoder)
     try:
-        body = await request.json()
+        items = body.items
+        semaphore = request.app.state.batch_semaphore
+        client = request.app.state.http
+        hf_semaphore = request.app.state.hf_semaphore
+
+        async def bounded(item: BatchModerationItem) -> dict:
+            async with semaphore:
+                return await moderate_batch_item(item, client, hf_semaphore)
+
+        # Items are independent I/O-bound calls, so run them concurrently
+        outcomes = await asyncio.gather(*(bounded(item) for item in items), return_exceptions=True)
+
         results = []
-        
-        for item in body.get("items", []):
-            if item.get("type") == "text":
-                result = await moderate_text(item.get("content", ""))
-            elif item.get("type") == "image":
-                result = await moderate_image(item.get("content", ""))
-            else:
-                result = {"isSafe": True, "confidence": 0.0, "reason": "Unknown type"}
-            
-            results.append({
-                "id": item.get("id"),
-                **result
-            })
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Batch item moderation failed: {outcome}")
+                # Default to safe on error
+                outcome = {
+                    "id": item.id,
+                    "isSafe": True,
+                    "confidence": 0.0,
+                    "reason": f"Moderation error: {str(outcome)}"
+                }
+            results.append(outcome)
         
         return {"results": results}
         
@@ -244,5 +480,8 @@ if __name__ == "__main__":
         host=settings.host,
         port=settings.port,
         reload=settings.debug,
+        workers=get_worker_count(settings),
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
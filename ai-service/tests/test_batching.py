@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_micro_batcher_coalesces_concurrent_items():
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(process, max_batch=3, max_wait_ms=50)
+
+    results = await asyncio.gather(*(batcher.submit(item) for item in range(5)))
+    await batcher.stop()
+
+    assert results == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2], [3, 4]]
+
+
+@pytest.mark.anyio
+async def test_micro_batcher_propagates_errors_to_every_caller():
+    def process(_items):
+        raise RuntimeError("inference failed")
+
+    batcher = MicroBatcher(process, max_batch=4, max_wait_ms=10)
+
+    outcomes = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+    await batcher.stop()
+
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from image_moderation import moderate_image, summarize_image_predictions
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_junk_base64_is_invalid_not_empty():
+    result = await moderate_image("###", None, asyncio.Semaphore(1))
+
+    assert result["isSafe"] is False
+    assert result["category"] == "invalid"
+
+
+def test_summary_returns_first_nsfw_label():
+    results = [{"label": "normal", "score": 0.6}, {"label": "Porn", "score": 0.3}, {"label": "nsfw", "score": 0.1}]
+
+    assert summarize_image_predictions(results) == {"label": "NSFW", "score": 0.3}
+
+
+def test_summary_keeps_highest_score_without_nsfw_label():
+    results = [{"label": "drawing", "score": 0.2}, {"label": "normal", "score": 0.7}, {"label": "neutral", "score": 0.1}]
+
+    assert summarize_image_predictions(results) == {"label": "NORMAL", "score": 0.7}
+
+
+def test_summary_of_no_predictions_is_safe():
+    assert summarize_image_predictions([]) == {"label": "SAFE", "score": 1.0}
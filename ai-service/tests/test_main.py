@@ -4,8 +4,12 @@ import sys
 import pytest
 from fastapi.testclient import TestClient
 
+from text_moderation import ModerationResult
+
 
 def load_main(monkeypatch, env):
+    # Keep startup from loading local models
+    env = {"USE_LOCAL_FALLBACK": "false", **env}
     for key, value in env.items():
         monkeypatch.setenv(key, value)
     if "config" in sys.modules:
@@ -32,13 +36,13 @@ async def test_hourly_stats_requires_api_key(monkeypatch):
         },
     )
 
-    async def fake_fetch(_settings):
+    async def fake_fetch(_settings, _pool):
         return build_buckets(main)
 
-    monkeypatch.setattr(main, "fetch_hourly_ticket_counts", fake_fetch)
+    monkeypatch.setattr(main, "fetch_cached_hourly_ticket_counts", fake_fetch)
 
-    client = TestClient(main.app)
-    response = client.get("/analytics/tickets/hourly")
+    with TestClient(main.app) as client:
+        response = client.get("/analytics/tickets/hourly")
     assert response.status_code == 401
 
 
@@ -52,15 +56,194 @@ async def test_hourly_stats_returns_buckets(monkeypatch):
         },
     )
 
-    async def fake_fetch(_settings):
+    async def fake_fetch(_settings, _pool):
         return build_buckets(main)
 
-    monkeypatch.setattr(main, "fetch_hourly_ticket_counts", fake_fetch)
+    monkeypatch.setattr(main, "fetch_cached_hourly_ticket_counts", fake_fetch)
 
-    client = TestClient(main.app)
-    response = client.get("/analytics/tickets/hourly", headers={"X-Analytics-Key": "secret"})
+    with TestClient(main.app) as client:
+        response = client.get("/analytics/tickets/hourly", headers={"X-Analytics-Key": "secret"})
     assert response.status_code == 200
     payload = response.json()
     assert payload["windowDays"] == main.settings.ticket_stats_window_days
     assert payload["timezone"] == main.settings.ticket_stats_timezone
     assert len(payload["buckets"]) == 24
+
+
+@pytest.mark.anyio
+async def test_batch_moderation_keeps_order_and_isolates_failures(monkeypatch):
+    main = load_main(monkeypatch, {})
+
+    async def fake_moderate_text(text, _client, _hf_semaphore):
+        if text == "boom":
+            raise RuntimeError("model crashed")
+        return ModerationResult(isSafe=text != "bad", confidence=0.9)
+
+    monkeypatch.setattr(main, "moderate_text", fake_moderate_text)
+
+    items = [
+        {"id": "a", "type": "text", "content": "hello"},
+        {"id": "b", "type": "text", "content": "boom"},
+        {"id": "c", "type": "text", "content": "bad"},
+        {"id": "d", "type": "video", "content": ""},
+    ]
+
+    with TestClient(main.app) as client:
+        response = client.post("/moderate/batch", json={"items": items})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["id"] for result in results] == ["a", "b", "c", "d"]
+    assert results[0]["isSafe"] is True
+    assert results[1]["isSafe"] is True
+    assert results[1]["reason"] == "Moderation error: model crashed"
+    assert results[2]["isSafe"] is False
+    assert results[3]["reason"] == "Unknown type"
+
+
+@pytest.mark.anyio
+async def test_raw_image_upload_is_moderated_without_base64(monkeypatch):
+    main = load_main(monkeypatch, {})
+    received = {}
+
+    async def fake_moderate_image_bytes(image_bytes, _client, _hf_semaphore):
+        received["bytes"] = image_bytes
+        return {"isSafe": False, "confidence": 0.95, "category": "nsfw", "reason": "Image flagged as nsfw"}
+
+    monkeypatch.setattr(main, "moderate_image_bytes", fake_moderate_image_bytes)
+
+    with TestClient(main.app) as client:
+        response = client.post(
+            "/moderate/image/raw",
+            files={"file": ("upload.png", b"\x89PNG-bytes", "image/png")},
+        )
+
+    assert response.status_code == 200
+    assert received["bytes"] == b"\x89PNG-bytes"
+    assert response.json()["isSafe"] is False
+    assert response.json()["category"] == "nsfw"
+
+
+@pytest.mark.anyio
+async def test_text_moderation_encodes_result_struct(monkeypatch):
+    main = load_main(monkeypatch, {})
+
+    async def fake_moderate_text(text, _client, _hf_semaphore):
+        return ModerationResult(isSafe=True, confidence=0.8, details={"nsfw": {"label": "SAFE", "score": 0.8}})
+
+    monkeypatch.setattr(main, "moderate_text", fake_moderate_text)
+
+    with TestClient(main.app) as client:
+        response = client.post("/moderate/text", json={"text": "hello"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "isSafe": True,
+        "confidence": 0.8,
+        "category": None,
+        "reason": None,
+        "details": {"nsfw": {"label": "SAFE", "score": 0.8}},
+    }
+
+
+@pytest.mark.anyio
+async def test_text_moderation_rejects_invalid_body(monkeypatch):
+    main = load_main(monkeypatch, {})
+
+    with TestClient(main.app) as client:
+        wrong_type = client.post("/moderate/text", json={"text": 5})
+        not_json = client.post("/moderate/text", content=b"not json")
+
+    assert wrong_type.status_code == 422
+    assert not_json.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_text_moderation_rejects_oversized_body(monkeypatch):
+    main = load_main(monkeypatch, {"MAX_INPUT_BYTES": "100"})
+
+    with TestClient(main.app) as client:
+        response = client.post("/moderate/text", json={"text": "x" * 200})
+
+    assert response.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_text_moderation_rejects_oversized_chunked_body(monkeypatch):
+    main = load_main(monkeypatch, {"MAX_INPUT_BYTES": "100"})
+
+    def chunks():
+        yield b'{"text": "'
+        for _ in range(1000):
+            yield b"x" * 50
+        yield b'"}'
+
+    with TestClient(main.app) as client:
+        response = client.post("/moderate/text", content=chunks())
+
+    assert "content-length" not in response.request.headers
+    assert response.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_startup_survives_failing_local_models(monkeypatch):
+    main = load_main(monkeypatch, {"USE_LOCAL_FALLBACK": "true"})
+    import text_moderation
+
+    def unavailable(*_args, **_kwargs):
+        raise OSError("model hub unreachable")
+
+    monkeypatch.setattr(main, "load_image_nsfw_model", lambda: None)
+    monkeypatch.setattr(text_moderation, "load_text_classifier", unavailable)
+    monkeypatch.setattr(text_moderation, "pipeline", unavailable)
+    monkeypatch.setattr(text_moderation, "_text_nsfw_pipeline", None)
+    monkeypatch.setattr(text_moderation, "_text_offensive_pipeline", None)
+
+    with TestClient(main.app) as client:
+        response = client.get("/health")
+
+    assert response.status_code == 200
+
+
+def test_openapi_documents_msgspec_request_bodies(monkeypatch):
+    main = load_main(monkeypatch, {})
+
+    paths = main.app.openapi()["paths"]
+
+    def body_schema(path):
+        return paths[path]["post"]["requestBody"]["content"]["application/json"]["schema"]
+
+    assert body_schema("/moderate/text")["required"] == ["text"]
+    assert "imageBase64" in body_schema("/moderate/image")["properties"]
+    item_schema = body_schema("/moderate/batch")["properties"]["items"]["items"]
+    assert set(item_schema["properties"]) == {"id", "type", "content"}
+
+
+def test_health_reports_multilabel_model(monkeypatch):
+    main = load_main(monkeypatch, {"TEXT_MULTILABEL_MODEL": "org/multilabel"})
+
+    with TestClient(main.app) as client:
+        response = client.get("/health")
+
+    assert response.json()["models"]["text_multilabel"] == "org/multilabel"
+
+
+def test_carto_export_lock_allows_a_single_holder(monkeypatch, tmp_path):
+    main = load_main(monkeypatch, {})
+    lock_path = tmp_path / "carto.lock"
+
+    with open(lock_path, "w") as leader, open(lock_path, "w") as follower:
+        assert main.try_acquire_export_lock(leader)
+        assert main.try_acquire_export_lock(leader)
+        assert not main.try_acquire_export_lock(follower)
+
+
+def test_auto_worker_count_is_capped_with_local_models(monkeypatch):
+    import config
+
+    monkeypatch.setattr(config.os, "cpu_count", lambda: 64)
+
+    assert config.get_worker_count(config.Settings(use_local_fallback=True)) == 2
+    assert config.get_worker_count(config.Settings(use_local_fallback=False)) == 64
+    assert config.get_worker_count(config.Settings(use_local_fallback=True, AI_SERVICE_WORKERS=8)) == 8
@@ -0,0 +1,284 @@
+import asyncio
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import text_moderation
+import text_prefilter
+from text_moderation import SequenceClassifier, clear_verdict_cache, length_bucket, moderate_text
+from text_prefilter import PREFILTER_SAFE, PREFILTER_UNSAFE, prefilter_text
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+
+    async def fake_api(text, model, _client, _hf_semaphore):
+        calls.append((text, model))
+        await asyncio.sleep(0.01)
+        return [[{"label": "SAFE", "score": 0.99}, {"label": "NSFW", "score": 0.01}]]
+
+    monkeypatch.setattr(text_moderation, "moderate_text_api", fake_api)
+    clear_verdict_cache()
+    yield calls
+    clear_verdict_cache()
+
+
+@pytest.mark.anyio
+async def test_repeated_text_is_served_from_verdict_cache(api_calls):
+    semaphore = asyncio.Semaphore(4)
+
+    first = await moderate_text("Hello there ", None, semaphore)
+    second = await moderate_text("hello there", None, semaphore)
+
+    assert first is second
+    assert first.isSafe is True
+    assert len(api_calls) == 2  # one NSFW + one offensive call
+
+
+@pytest.mark.anyio
+async def test_concurrent_duplicates_share_one_evaluation(api_calls):
+    semaphore = asyncio.Semaphore(4)
+
+    results = await asyncio.gather(*(moderate_text("same post", None, semaphore) for _ in range(5)))
+
+    assert all(result is results[0] for result in results)
+    assert len(api_calls) == 2
+
+
+@pytest.fixture
+def lexicon(tmp_path, monkeypatch):
+    path = tmp_path / "lexicon.txt"
+    path.write_text("# test lexicon\nbadword\n!slurword\n", encoding="utf-8")
+    monkeypatch.setattr(text_prefilter.settings, "text_prefilter_lexicon", str(path))
+    text_prefilter.load_lexicon.cache_clear()
+    yield path
+    text_prefilter.load_lexicon.cache_clear()
+
+
+def test_prefilter_decides_obvious_cases(lexicon):
+    assert prefilter_text("What a lovely day") == PREFILTER_SAFE
+    assert prefilter_text("you SLURWORD") == PREFILTER_UNSAFE
+    assert prefilter_text("that badword again") is None
+    assert prefilter_text("see https://example.com") is None
+    assert prefilter_text("lovely " * 40) is None
+
+
+def test_prefilter_matches_terms_with_symbol_edges(tmp_path, monkeypatch):
+    path = tmp_path / "lexicon.txt"
+    path.write_text("a$$\n!@sshole\n", encoding="utf-8")
+    monkeypatch.setattr(text_prefilter.settings, "text_prefilter_lexicon", str(path))
+    text_prefilter.load_lexicon.cache_clear()
+
+    assert prefilter_text("you a$$") is None
+    assert prefilter_text("what an @sshole") == PREFILTER_UNSAFE
+    assert prefilter_text("a$$et management") == PREFILTER_SAFE
+    text_prefilter.load_lexicon.cache_clear()
+
+
+def test_missing_lexicon_disables_prefilter_and_is_read_once(tmp_path, monkeypatch):
+    missing = tmp_path / "missing.txt"
+    monkeypatch.setattr(text_prefilter.settings, "text_prefilter_lexicon", str(missing))
+    text_prefilter.load_lexicon.cache_clear()
+    reads = []
+    read_text = text_prefilter.Path.read_text
+
+    def counting_read_text(self, *args, **kwargs):
+        reads.append(self)
+        return read_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(text_prefilter.Path, "read_text", counting_read_text)
+
+    assert prefilter_text("What a lovely day") is None
+    assert prefilter_text("Another lovely day") is None
+    assert len(reads) == 1
+    text_prefilter.load_lexicon.cache_clear()
+
+
+@pytest.mark.anyio
+async def test_prefiltered_text_skips_models(lexicon, api_calls):
+    semaphore = asyncio.Semaphore(4)
+
+    safe = await moderate_text("What a lovely day", None, semaphore)
+    unsafe = await moderate_text("you slurword", None, semaphore)
+
+    assert safe.isSafe is True
+    assert unsafe.isSafe is False
+    assert unsafe.category == "offensive"
+    assert api_calls == []
+
+
+def test_length_bucket_picks_smallest_fitting_bucket():
+    assert length_bucket(5) == 0
+    assert length_bucket(32) == 0
+    assert length_bucket(33) == 1
+    assert length_bucket(512) == 2
+
+
+@pytest.mark.anyio
+async def test_api_labels_are_matched_case_insensitively(monkeypatch):
+    async def fake_api(text, model, _client, _hf_semaphore):
+        if model == text_moderation.settings.text_nsfw_model:
+            return [[{"label": "nsfw", "score": 0.95}, {"label": "safe", "score": 0.05}]]
+        return [[{"label": "not_offensive", "score": 0.9}, {"label": "offensive", "score": 0.1}]]
+
+    monkeypatch.setattr(text_moderation, "moderate_text_api", fake_api)
+    clear_verdict_cache()
+
+    result = await moderate_text("  something explicit  ", None, asyncio.Semaphore(4))
+    clear_verdict_cache()
+
+    assert result.isSafe is False
+    assert result.category == "nsfw"
+    assert result.details["nsfw"]["label"] == "NSFW"
+
+
+@pytest.mark.anyio
+async def test_multilabel_model_needs_one_api_call(monkeypatch):
+    calls = []
+
+    async def fake_api(text, model, _client, _hf_semaphore, parameters=None):
+        calls.append((model, parameters))
+        return [[{"label": "nsfw", "score": 0.1}, {"label": "toxic", "score": 0.9}]]
+
+    monkeypatch.setattr(text_moderation.settings, "text_multilabel_model", "org/multilabel")
+    monkeypatch.setattr(text_moderation, "moderate_text_api", fake_api)
+    clear_verdict_cache()
+
+    result = await moderate_text("some text", None, asyncio.Semaphore(4))
+    clear_verdict_cache()
+
+    assert calls == [("org/multilabel", text_moderation.MULTILABEL_API_PARAMETERS)]
+    assert result.isSafe is False
+    assert result.category == "offensive"
+    assert result.details["nsfw"]["label"] == "SAFE"
+
+
+@pytest.mark.anyio
+async def test_padded_text_is_trimmed_before_moderation(api_calls):
+    semaphore = asyncio.Semaphore(4)
+
+    empty = await moderate_text(" \n\t " * 1000, None, semaphore)
+    await moderate_text(" " * 5000 + "hello" + " " * 5000, None, semaphore)
+
+    assert empty.details == {}
+    assert {text for text, _ in api_calls} == {"hello"}
+
+
+@pytest.mark.anyio
+async def test_verdicts_from_failed_local_models_are_not_cached(monkeypatch):
+    async def api_down(text, model, _client, _hf_semaphore, parameters=None):
+        return None
+
+    def broken(texts, **_kwargs):
+        raise RuntimeError("inference failed")
+
+    monkeypatch.setattr(text_moderation, "moderate_text_api", api_down)
+    monkeypatch.setattr(text_moderation.settings, "use_local_fallback", True)
+    monkeypatch.setattr(text_moderation, "_text_nsfw_pipeline", broken)
+    monkeypatch.setattr(text_moderation, "_text_offensive_pipeline", broken)
+    clear_verdict_cache()
+
+    result = await moderate_text("some explicit stuff", None, asyncio.Semaphore(4))
+    await text_moderation.text_batcher.stop()
+
+    assert result.isSafe is True
+    assert "degraded" not in result.details
+    assert len(text_moderation._verdict_cache) == 0
+
+
+class StubTokenizer:
+    """One token per word; pads with numpy like a HF tokenizer would"""
+
+    def __call__(self, texts, truncation, max_length):
+        ids = [list(range(len(text.split())))[:max_length] for text in texts]
+        return {"input_ids": ids, "attention_mask": [[1] * len(row) for row in ids]}
+
+    def pad(self, features, padding, pad_to_multiple_of, return_tensors):
+        longest = max(len(feature["input_ids"]) for feature in features)
+        width = -(-longest // pad_to_multiple_of) * pad_to_multiple_of
+        return {
+            key: np.array([feature[key] + [0] * (width - len(feature[key])) for feature in features])
+            for key in ("input_ids", "attention_mask")
+        }
+
+
+class StubModel:
+    """Logits depend only on the unpadded length: odd -> label 1, even -> label 0"""
+
+    config = SimpleNamespace(id2label={0: "safe", 1: "nsfw"})
+    device = SimpleNamespace(type="cpu")
+
+    def __init__(self):
+        self.widths = []
+
+    def __call__(self, input_ids, attention_mask):
+        self.widths.append(input_ids.shape[1])
+        lengths = attention_mask.sum(axis=1)
+        logits = np.where((lengths % 2 == 1)[:, None], [0.0, 1.0], [2.0, 0.0])
+        return SimpleNamespace(logits=logits)
+
+
+def words(n):
+    return " ".join(["w"] * n)
+
+
+def test_bucketed_classification_keeps_input_order():
+    model = StubModel()
+    classifier = SequenceClassifier(StubTokenizer(), model)
+    lengths = [3, 40, 200, 6, 131]
+
+    results = classifier.classify_batch([words(n) for n in lengths])
+
+    # One padded pass per bucket (<=32, <=128, <=512), widths rounded to 8
+    assert sorted(model.widths) == [8, 40, 200]
+    for n, result in zip(lengths, results):
+        if n % 2:
+            assert result["label"] == "NSFW"
+            assert result["score"] == pytest.approx(1 / (1 + math.exp(-1)))
+        else:
+            assert result["label"] == "SAFE"
+            assert result["score"] == pytest.approx(1 / (1 + math.exp(-2)))
+
+
+def test_label_scores_are_independent_sigmoids():
+    classifier = SequenceClassifier(StubTokenizer(), StubModel())
+
+    odd, even = classifier.label_scores_batch([words(3), words(200)])
+
+    assert odd == pytest.approx({"SAFE": 0.5, "NSFW": 1 / (1 + math.exp(-1))})
+    assert even == pytest.approx({"SAFE": 1 / (1 + math.exp(-2)), "NSFW": 0.5})
+
+
+@pytest.mark.anyio
+async def test_malformed_api_bodies_fall_back_to_local(monkeypatch):
+    async def odd_api(text, model, _client, _hf_semaphore, parameters=None):
+        return {"error": "unexpected"} if model == text_moderation.settings.text_nsfw_model else []
+
+    local_calls = []
+
+    async def fake_local(text):
+        local_calls.append(text)
+        return {
+            "nsfw": {"label": "SAFE", "score": 0.9},
+            "offensive": {"label": "NOT_OFFENSIVE", "score": 0.9},
+            "degraded": False,
+        }
+
+    monkeypatch.setattr(text_moderation, "moderate_text_api", odd_api)
+    monkeypatch.setattr(text_moderation, "moderate_text_local", fake_local)
+    monkeypatch.setattr(text_moderation.settings, "use_local_fallback", True)
+    clear_verdict_cache()
+
+    result = await moderate_text("hello", None, asyncio.Semaphore(4))
+    clear_verdict_cache()
+
+    assert local_calls == ["hello"]
+    assert result.isSafe is True
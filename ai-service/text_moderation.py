@@ -2,13 +2,26 @@
 ODAN AI Service - Text Moderation
 """
 
+import asyncio
+import hashlib
 import logging
+import re
+from contextlib import nullcontext
+from itertools import groupby
+from pathlib import Path
 from typing import Optional
 import httpx
+import msgspec
+import numpy as np
+import orjson
+from cachetools import TTLCache
 from transformers import pipeline, AutoModelForSequenceClassification, AutoTokenizer
 import torch
 
-from config import get_settings
+from batching import MicroBatcher
+from cpu_features import cpu_supports_amx_bf16, cpu_supports_vnni
+from text_prefilter import PREFILTER_SAFE, PREFILTER_UNSAFE, prefilter_text
+from config import get_inference_threads, get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -16,34 +29,284 @@ settings = get_settings()
 # Cache for loaded models
 _text_nsfw_pipeline = None
 _text_offensive_pipeline = None
+_text_multilabel_model = None
 
+# Maximum characters of a text that are moderated
+MAX_TEXT_CHARS = 2000
 
-async def moderate_text_api(text: str, model: str) -> dict | None:
+# Maximum tokens fed to local classifiers
+MAX_MODEL_TOKENS = 512
+
+# Batched texts are grouped by token length and padded per group, so a short
+# comment is never padded out to the length of a long post in the same batch
+LENGTH_BUCKETS = (32, 128, MAX_MODEL_TOKENS)
+PAD_TO_MULTIPLE_OF = 8
+
+# Upper-case labels that count as flagged; labels are upper-cased once where
+# predictions enter the service
+_NSFW_UNSAFE = frozenset({"NSFW", "UNSAFE", "1", "LABEL_1"})
+_OFFENSIVE_BAD = frozenset({"OFFENSIVE", "HATE", "TOXIC", "1", "LABEL_1"})
+
+_NON_SPACE = re.compile(r"\S")
+
+# Heads of a multi-label classifier that feed each category
+_MULTILABEL_NSFW = frozenset({"NSFW", "UNSAFE"})
+_MULTILABEL_OFFENSIVE = frozenset({"OFFENSIVE", "HATE", "TOXIC"})
+
+# Ask the Inference API for every label's independent sigmoid score
+MULTILABEL_API_PARAMETERS = {"function_to_apply": "sigmoid", "top_k": None}
+
+# Micro-batching for local inference
+TEXT_BATCH_MAX = 16
+TEXT_BATCH_TIMEOUT_MS = 5
+
+# Verdict cache keyed by a hash of the normalized text; repeat posts, spam
+# floods and bot traffic skip the models entirely
+VERDICT_CACHE_SIZE = 10_000
+VERDICT_CACHE_TTL_SECONDS = 3600
+_verdict_cache: TTLCache = TTLCache(maxsize=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL_SECONDS)
+_verdicts_in_flight: dict[bytes, asyncio.Task] = {}
+
+
+class ModerationResult(msgspec.Struct, frozen=True):
+    """Verdict returned by moderate_text; immutable so cached verdicts can be shared"""
+    isSafe: bool
+    confidence: float
+    category: Optional[str] = None
+    reason: Optional[str] = None
+    details: dict = {}
+
+
+class SequenceClassifier:
+    """
+    Tokenizer + sequence classification model with a pipeline-like call
+
+    Works with both PyTorch models and ONNX Runtime (optimum) models, which
+    share the ``model(**inputs).logits`` interface. ONNX models are fed numpy
+    arrays so their outputs never round-trip through torch tensors.
+    """
+
+    def __init__(self, tokenizer, model, autocast_dtype: torch.dtype | None = None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.id2label = {index: label.upper() for index, label in model.config.id2label.items()}
+        self.device = model.device
+        self.autocast_dtype = autocast_dtype
+        self.tensor_type = "pt" if isinstance(model, torch.nn.Module) else "np"
+
+    def __call__(self, text: str) -> list[dict]:
+        return self.classify_batch([text])
+
+    def classify_batch(self, texts: list[str]) -> list[dict]:
+        """Top label/score for each text, one forward pass per length bucket"""
+        return self._run_bucketed(texts, self._top_labels)
+
+    def label_scores_batch(self, texts: list[str]) -> list[dict[str, float]]:
+        """Independent sigmoid score per label for each text (multi-label heads)"""
+        return self._run_bucketed(texts, self._sigmoid_scores)
+
+    def _run_bucketed(self, texts: list[str], postprocess) -> list:
+        encoded = self.tokenizer(texts, truncation=True, max_length=MAX_MODEL_TOKENS)
+        features = [dict(zip(encoded.keys(), values)) for values in zip(*encoded.values())]
+        lengths = [len(feature["input_ids"]) for feature in features]
+
+        # Sort by length, then pad each bucket only to its own longest member
+        order = sorted(range(len(texts)), key=lengths.__getitem__)
+        results: list = [None] * len(texts)
+        for _, group in groupby(order, key=lambda i: length_bucket(lengths[i])):
+            indices = list(group)
+            inputs = self.tokenizer.pad(
+                [features[i] for i in indices],
+                padding="longest",
+                pad_to_multiple_of=PAD_TO_MULTIPLE_OF,
+                return_tensors=self.tensor_type
+            )
+            if self.tensor_type == "pt":
+                inputs = inputs.to(self.device)
+            for i, result in zip(indices, postprocess(self._logits(inputs))):
+                results[i] = result
+        return results
+
+    def _logits(self, inputs) -> np.ndarray:
+        autocast = (
+            torch.autocast(self.device.type, dtype=self.autocast_dtype)
+            if self.autocast_dtype is not None
+            else nullcontext()
+        )
+        with autocast, torch.inference_mode():
+            logits = self.model(**inputs).logits
+        if isinstance(logits, torch.Tensor):
+            logits = logits.float().cpu().numpy()
+        return logits
+
+    def _top_labels(self, logits: np.ndarray) -> list[dict]:
+        # Only the top class is needed: its softmax probability is
+        # 1 / sum(exp(logits - max)), no full probability vector required
+        indices = logits.argmax(axis=-1)
+        top = logits[np.arange(len(indices)), indices]
+        scores = 1.0 / np.exp(logits - top[:, None]).sum(axis=-1)
+        return [
+            {"label": self.id2label[index], "score": score}
+            for index, score in zip(indices.tolist(), scores.tolist())
+        ]
+
+    def _sigmoid_scores(self, logits: np.ndarray) -> list[dict[str, float]]:
+        probs = 1.0 / (1.0 + np.exp(-logits))
+        return [
+            {self.id2label[index]: score for index, score in enumerate(row)}
+            for row in probs.tolist()
+        ]
+
+
+def length_bucket(num_tokens: int) -> int:
+    """Index of the smallest LENGTH_BUCKETS entry that fits num_tokens"""
+    for bucket, limit in enumerate(LENGTH_BUCKETS):
+        if num_tokens <= limit:
+            return bucket
+    return len(LENGTH_BUCKETS) - 1
+
+
+def onnx_model_dir(model_name: str) -> Path:
+    """Where export_onnx_models.py writes the ONNX artifacts for a model"""
+    return Path(settings.models_dir) / "onnx" / model_name.replace("/", "--")
+
+
+def has_onnx_model(model_dir: Path) -> bool:
+    return (model_dir / "model.onnx").exists() or (model_dir / "model_quantized.onnx").exists()
+
+
+def is_local_model(model_name: str) -> bool:
+    """Model settings may name a local directory instead of a Hub id"""
+    return Path(model_name).is_dir()
+
+
+def load_onnx_classifier(model_dir: Path) -> SequenceClassifier:
+    """Load an exported ONNX classifier on the ONNX Runtime CPU provider"""
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+
+    quantized = (model_dir / "model_quantized.onnx").exists()
+    use_quantized = quantized and (cpu_supports_vnni() or not (model_dir / "model.onnx").exists())
+    file_name = "model_quantized.onnx" if use_quantized else "model.onnx"
+
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session_options.intra_op_num_threads = get_inference_threads(settings)
+    session_options.inter_op_num_threads = 1
+
+    logger.info(f"Using ONNX Runtime model {model_dir / file_name}")
+    model = ORTModelForSequenceClassification.from_pretrained(
+        model_dir,
+        file_name=file_name,
+        provider="CPUExecutionProvider",
+        session_options=session_options
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    return SequenceClassifier(tokenizer, model)
+
+
+def configure_torch_threads() -> None:
+    """Size PyTorch's thread pools for one worker (process-wide, call before loading models)"""
+    threads = get_inference_threads(settings)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before any inter-op work has started
+        pass
+    logger.info(f"Local inference threads per worker: {threads}")
+
+
+def load_torch_classifier(model_name: str) -> SequenceClassifier:
+    """
+    Load a PyTorch classifier with fused attention where available
+
+    BetterTransformer swaps the encoder layers for PyTorch's fused
+    scaled-dot-product attention kernels, which skip materializing the
+    attention intermediates. On AMX CPUs with intel_extension_for_pytorch
+    installed, the model is instead optimized by IPEX and run in BF16.
+    """
+    use_cuda = torch.cuda.is_available()
+    dtype = torch.float16 if use_cuda and settings.quantize_local_models else torch.float32
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, torch_dtype=dtype)
+    model.to("cuda" if use_cuda else "cpu").eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if not use_cuda and settings.quantize_local_models and cpu_supports_amx_bf16():
+        try:
+            import intel_extension_for_pytorch as ipex
+        except ImportError:
+            logger.info("intel_extension_for_pytorch not installed, skipping AMX BF16")
+        else:
+            model = ipex.optimize(model, dtype=torch.bfloat16, level="O1")
+            return SequenceClassifier(tokenizer, model, autocast_dtype=torch.bfloat16)
+
+    try:
+        from optimum.bettertransformer import BetterTransformer
+        model = BetterTransformer.transform(model)
+    except Exception as e:
+        logger.warning(f"BetterTransformer unavailable for {model_name}, using eager attention: {e}")
+
+    return SequenceClassifier(tokenizer, model)
+
+
+def load_text_classifier(model_name: str):
+    """
+    Load a text classifier, preferring ONNX artifacts
+
+    A local directory that already holds an ONNX model (e.g. a distilled,
+    pruned INT8 classifier shipped with the deployment) is served directly
+    with no Hub download. Otherwise CPU hosts use the export_onnx_models.py
+    output when present, and everything else falls back to PyTorch.
+    """
+    local_dir = Path(model_name)
+    if local_dir.is_dir() and has_onnx_model(local_dir):
+        return load_onnx_classifier(local_dir)
+
+    if not torch.cuda.is_available():
+        model_dir = onnx_model_dir(model_name)
+        if has_onnx_model(model_dir):
+            try:
+                return load_onnx_classifier(model_dir)
+            except Exception as e:
+                logger.error(f"Failed to load ONNX model from {model_dir}: {e}")
+
+    return load_torch_classifier(model_name)
+
+
+async def moderate_text_api(
+    text: str,
+    model: str,
+    client: httpx.AsyncClient,
+    hf_semaphore: asyncio.Semaphore,
+    parameters: dict | None = None,
+) -> dict | None:
     """
     Call HuggingFace API for text moderation
     Returns None if API call fails
     """
-    if not settings.huggingface_api_token:
+    if not settings.huggingface_api_token or is_local_model(model):
         return None
     
     try:
-        async with httpx.AsyncClient() as client:
+        async with hf_semaphore:
             response = await client.post(
                 f"{settings.huggingface_api_url}/{model}",
                 headers={"Authorization": f"Bearer {settings.huggingface_api_token}"},
-                json={"inputs": text},
+                json={"inputs": text, "parameters": parameters} if parameters else {"inputs": text},
                 timeout=30.0
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 503:
-                # Model is loading
-                logger.warning(f"Model {model} is loading, falling back to local")
-                return None
-            else:
-                logger.error(f"API error for {model}: {response.status_code}")
-                return None
+        
+        if response.status_code == 200:
+            return orjson.loads(response.content)
+        elif response.status_code == 503:
+            # Model is loading
+            logger.warning(f"Model {model} is loading, falling back to local")
+            return None
+        else:
+            logger.error(f"API error for {model}: {response.status_code}")
+            return None
                 
     except Exception as e:
         logger.error(f"API call failed for {model}: {e}")
@@ -57,19 +320,19 @@ def load_text_nsfw_model():
     if _text_nsfw_pipeline is None:
         logger.info(f"Loading text NSFW model: {settings.text_nsfw_model}")
         try:
-            _text_nsfw_pipeline = pipeline(
-                "text-classification",
-                model=settings.text_nsfw_model,
-                device=0 if torch.cuda.is_available() else -1
-            )
+            _text_nsfw_pipeline = load_text_classifier(settings.text_nsfw_model)
         except Exception as e:
             logger.error(f"Failed to load text NSFW model: {e}")
             # Try with smaller model
-            _text_nsfw_pipeline = pipeline(
-                "text-classification",
-                model="distilbert-base-uncased-finetuned-sst-2-english",
-                device=-1
-            )
+            try:
+                _text_nsfw_pipeline = pipeline(
+                    "text-classification",
+                    model="distilbert-base-uncased-finetuned-sst-2-english",
+                    device=-1
+                )
+            except Exception as e:
+                logger.error(f"Failed to load fallback text model: {e}")
+                _text_nsfw_pipeline = None
     
     return _text_nsfw_pipeline
 
@@ -81,11 +344,7 @@ def load_text_offensive_model():
     if _text_offensive_pipeline is None:
         logger.info(f"Loading text offensive model: {settings.text_offensive_model}")
         try:
-            _text_offensive_pipeline = pipeline(
-                "text-classification",
-                model=settings.text_offensive_model,
-                device=0 if torch.cuda.is_available() else -1
-            )
+            _text_offensive_pipeline = load_text_classifier(settings.text_offensive_model)
         except Exception as e:
             logger.error(f"Failed to load offensive model: {e}")
             _text_offensive_pipeline = None
@@ -93,95 +352,285 @@ def load_text_offensive_model():
     return _text_offensive_pipeline
 
 
-def moderate_text_local(text: str) -> dict:
-    """
-    Run local text moderation
-    """
-    results = {
-        "nsfw": {"label": "SAFE", "score": 0.0},
-        "offensive": {"label": "NOT_OFFENSIVE", "score": 0.0}
-    }
+def load_text_multilabel_model():
+    """Load the optional single multi-label text classifier"""
+    global _text_multilabel_model
     
-    # NSFW check
-    nsfw_model = load_text_nsfw_model()
-    if nsfw_model:
+    if _text_multilabel_model is None:
+        logger.info(f"Loading multi-label text model: {settings.text_multilabel_model}")
         try:
-            nsfw_result = nsfw_model(text[:512])[0]  # Limit text length
-            results["nsfw"] = {
-                "label": nsfw_result["label"],
-                "score": nsfw_result["score"]
-            }
+            _text_multilabel_model = load_text_classifier(settings.text_multilabel_model)
         except Exception as e:
-            logger.error(f"NSFW classification failed: {e}")
+            logger.error(f"Failed to load multi-label text model: {e}")
+            _text_multilabel_model = None
     
-    # Offensive check
-    offensive_model = load_text_offensive_model()
-    if offensive_model:
+    return _text_multilabel_model
+
+
+def split_label_scores(scores: dict[str, float]) -> dict:
+    """
+    Fold per-label sigmoid scores from a multi-label model into the
+    nsfw/offensive result pair the two-model path produces
+    """
+    nsfw = max((score for label, score in scores.items() if label in _MULTILABEL_NSFW), default=0.0)
+    offensive = max(
+        (score for label, score in scores.items() if label in _MULTILABEL_OFFENSIVE), default=0.0
+    )
+    return {
+        "nsfw": (
+            {"label": "NSFW", "score": nsfw}
+            if nsfw >= settings.nsfw_threshold
+            else {"label": "SAFE", "score": 1.0 - nsfw}
+        ),
+        "offensive": (
+            {"label": "OFFENSIVE", "score": offensive}
+            if offensive >= settings.offensive_threshold
+            else {"label": "NOT_OFFENSIVE", "score": 1.0 - offensive}
+        ),
+    }
+
+
+def canonical_prediction(prediction: dict) -> dict:
+    """Label/score pair with the label upper-cased"""
+    return {"label": str(prediction.get("label", "")).upper(), "score": prediction.get("score", 0.0)}
+
+
+def api_predictions(body) -> list[dict] | None:
+    """
+    Canonical predictions from an Inference API text-classification body
+
+    The API answers ``[[{label, score}, ...]]`` for a single input (older
+    deployments a flat list). Anything else is rejected with None.
+    """
+    if not isinstance(body, list) or not body:
+        return None
+    predictions = body[0] if isinstance(body[0], list) else body
+    if not predictions or not all(isinstance(prediction, dict) for prediction in predictions):
+        return None
+    return [canonical_prediction(prediction) for prediction in predictions]
+
+
+def classify_texts(model, texts: list[str]) -> list[dict]:
+    """Top label/score per text from a SequenceClassifier or transformers pipeline"""
+    if isinstance(model, SequenceClassifier):
+        return model.classify_batch(texts)
+    return [canonical_prediction(p) for p in model(texts, batch_size=len(texts), truncation=True)]
+
+
+def _classify(model, texts: list[str], default: dict, kind: str) -> tuple[list[dict], bool]:
+    """
+    Top label/score per text from one model, or ``default`` for each text on
+    failure; the flag is False when the defaults were used
+    """
+    if not model:
+        return [dict(default) for _ in texts], False
+    try:
+        return [
+            {"label": prediction["label"], "score": prediction["score"]}
+            for prediction in classify_texts(model, texts)
+        ], True
+    except Exception as e:
+        logger.error(f"{kind} classification failed: {e}")
+        return [dict(default) for _ in texts], False
+
+
+def classify_text_batch(texts: list[str]) -> list[dict]:
+    """
+    Run local text moderation for a batch, one forward pass per model
+
+    Each result carries a "degraded" flag, set when a model was missing or
+    failed and its defaults stand in for a real prediction.
+    """
+    if settings.text_multilabel_model:
+        return classify_text_batch_multilabel(texts)
+
+    nsfw, nsfw_ok = _classify(load_text_nsfw_model(), texts, {"label": "SAFE", "score": 0.0}, "NSFW")
+    offensive, offensive_ok = _classify(
+        load_text_offensive_model(), texts, {"label": "NOT_OFFENSIVE", "score": 0.0}, "Offensive"
+    )
+    degraded = not (nsfw_ok and offensive_ok)
+    return [
+        {"nsfw": nsfw_result, "offensive": offensive_result, "degraded": degraded}
+        for nsfw_result, offensive_result in zip(nsfw, offensive)
+    ]
+
+
+def classify_text_batch_multilabel(texts: list[str]) -> list[dict]:
+    """Run local text moderation for a batch with one multi-label forward pass"""
+    model = load_text_multilabel_model()
+    if model:
         try:
-            offensive_result = offensive_model(text[:512])[0]
-            results["offensive"] = {
-                "label": offensive_result["label"],
-                "score": offensive_result["score"]
-            }
+            return [
+                {**split_label_scores(scores), "degraded": False}
+                for scores in model.label_scores_batch(texts)
+            ]
         except Exception as e:
-            logger.error(f"Offensive classification failed: {e}")
-    
-    return results
+            logger.error(f"Multi-label classification failed: {e}")
+    return [{**split_label_scores({}), "degraded": True} for _ in texts]
+
 
+def warmup_text_models() -> None:
+    """
+    Load the text classifiers and run one dummy batch to warm their kernels
 
-async def moderate_text(text: str) -> dict:
+    Never raises: a model that can't load now is retried on first use, and
+    the HuggingFace API path keeps working meanwhile.
+    """
+    try:
+        if settings.text_multilabel_model:
+            load_text_multilabel_model()
+        else:
+            load_text_nsfw_model()
+            load_text_offensive_model()
+        classify_text_batch(["ok"])
+    except Exception as e:
+        logger.error(f"Text model warm-up failed: {e}")
+
+
+text_batcher: MicroBatcher[str, dict] = MicroBatcher(
+    classify_text_batch,
+    max_batch=TEXT_BATCH_MAX,
+    max_wait_ms=TEXT_BATCH_TIMEOUT_MS,
+)
+
+
+async def moderate_text_local(text: str) -> dict:
+    """
+    Run local text moderation, coalescing concurrent requests into batches
+    """
+    return await text_batcher.submit(text[:512])  # Limit text length
+
+
+async def moderate_text(
+    text: str,
+    client: httpx.AsyncClient,
+    hf_semaphore: asyncio.Semaphore,
+) -> ModerationResult:
     """
     Main text moderation function
     Tries API first, falls back to local
     
+    Args:
+        text: Text to moderate
+        client: Shared HTTP client used for HuggingFace API calls
+        hf_semaphore: Shared limit on in-flight HuggingFace API calls
+    
     Returns:
-        {
-            "isSafe": bool,
-            "confidence": float,
-            "category": str | None,
-            "reason": str | None,
-            "details": dict
-        }
-    """
-    if not text or len(text.strip()) == 0:
-        return {
-            "isSafe": True,
-            "confidence": 1.0,
-            "category": None,
-            "reason": None,
-            "details": {}
-        }
+        ModerationResult
+    """
+    # Find the first non-whitespace character without copying the input, so
+    # an oversized payload is sliced before anything is stripped
+    first = _NON_SPACE.search(text) if text else None
+    if first is None:
+        return ModerationResult(isSafe=True, confidence=1.0)
     
     # Clean text
-    text = text.strip()[:2000]  # Limit to 2000 chars
+    start = first.start()
+    text = text[start:start + MAX_TEXT_CHARS].rstrip()
+    
+    # Obvious cases are settled by the lexicon without any model call
+    prefilter = prefilter_text(text)
+    if prefilter == PREFILTER_SAFE:
+        return ModerationResult(isSafe=True, confidence=1.0, details={"prefilter": PREFILTER_SAFE})
+    if prefilter == PREFILTER_UNSAFE:
+        return ModerationResult(
+            isSafe=False,
+            confidence=1.0,
+            category="offensive",
+            reason="Content flagged as offensive/hateful",
+            details={"prefilter": PREFILTER_UNSAFE}
+        )
     
+    key = hashlib.blake2b(text.lower().encode(), digest_size=16).digest()
+    cached = _verdict_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    # Identical texts already being moderated share one evaluation
+    task = _verdicts_in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_moderate_and_cache(key, text, client, hf_semaphore))
+        _verdicts_in_flight[key] = task
+        task.add_done_callback(lambda _: _verdicts_in_flight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+def clear_verdict_cache() -> None:
+    _verdict_cache.clear()
+
+
+async def _moderate_and_cache(
+    key: bytes,
+    text: str,
+    client: httpx.AsyncClient,
+    hf_semaphore: asyncio.Semaphore,
+) -> ModerationResult:
+    verdict, cacheable = await classify_text(text, client, hf_semaphore)
+    # Only cache verdicts backed by real model results, never "moderation
+    # unavailable" or local defaults standing in for a failed model
+    if cacheable:
+        _verdict_cache[key] = verdict
+    return verdict
+
+
+async def moderate_text_remote(
+    text: str,
+    client: httpx.AsyncClient,
+    hf_semaphore: asyncio.Semaphore,
+) -> dict | None:
+    """
+    nsfw/offensive results from the HuggingFace API
+    Returns None unless every required API call succeeded
+    """
+    if settings.text_multilabel_model:
+        # One call scores every label of the multi-label model
+        api_scores = await moderate_text_api(
+            text, settings.text_multilabel_model, client, hf_semaphore, parameters=MULTILABEL_API_PARAMETERS
+        )
+        predictions = api_predictions(api_scores)
+        if predictions is None:
+            return None
+        return split_label_scores({prediction["label"]: prediction["score"] for prediction in predictions})
+
+    # The two model calls are independent, so issue them concurrently
+    api_nsfw, api_offensive = await asyncio.gather(
+        moderate_text_api(text, settings.text_nsfw_model, client, hf_semaphore),
+        moderate_text_api(text, settings.text_offensive_model, client, hf_semaphore)
+    )
+    nsfw_predictions = api_predictions(api_nsfw)
+    offensive_predictions = api_predictions(api_offensive)
+    if nsfw_predictions is None or offensive_predictions is None:
+        return None
+
+    return {
+        "nsfw": max(nsfw_predictions, key=lambda prediction: prediction["score"]),
+        "offensive": max(offensive_predictions, key=lambda prediction: prediction["score"])
+    }
+
+
+async def classify_text(
+    text: str,
+    client: httpx.AsyncClient,
+    hf_semaphore: asyncio.Semaphore,
+) -> tuple[ModerationResult, bool]:
+    """
+    Moderate cleaned text without consulting the verdict cache
+    Returns the verdict and whether it is safe to cache
+    """
     # Try API first
-    api_nsfw = await moderate_text_api(text, settings.text_nsfw_model)
-    api_offensive = await moderate_text_api(text, settings.text_offensive_model)
+    results = await moderate_text_remote(text, client, hf_semaphore)
     
-    # If both API calls succeeded, use them
-    if api_nsfw and api_offensive:
-        nsfw_result = api_nsfw[0] if isinstance(api_nsfw, list) else api_nsfw
-        offensive_result = api_offensive[0] if isinstance(api_offensive, list) else api_offensive
-        
-        results = {
-            "nsfw": nsfw_result,
-            "offensive": offensive_result
-        }
-    elif settings.use_local_fallback:
+    if results is None and settings.use_local_fallback:
         # Fall back to local
         logger.info("Using local models for text moderation")
-        results = moderate_text_local(text)
-    else:
+        results = await moderate_text_local(text)
+        cacheable = not results.pop("degraded", False)
+    elif results is None:
         # No moderation available, allow content
         logger.warning("No moderation available, allowing content")
-        return {
-            "isSafe": True,
-            "confidence": 0.5,
-            "category": None,
-            "reason": "Moderation unavailable",
-            "details": {}
-        }
+        return ModerationResult(isSafe=True, confidence=0.5, reason="Moderation unavailable"), False
+    else:
+        cacheable = True
     
     # Analyze results
     is_safe = True
@@ -191,10 +640,10 @@ async def moderate_text(text: str) -> dict:
     
     # Check NSFW
     nsfw = results.get("nsfw", {})
-    nsfw_label = nsfw.get("label", "").upper()
+    nsfw_label = nsfw.get("label", "")
     nsfw_score = nsfw.get("score", 0.0)
     
-    if nsfw_label in ["NSFW", "UNSAFE", "1", "LABEL_1"] and nsfw_score >= settings.nsfw_threshold:
+    if nsfw_label in _NSFW_UNSAFE and nsfw_score >= settings.nsfw_threshold:
         is_safe = False
         confidence = nsfw_score
         category = "nsfw"
@@ -202,19 +651,19 @@ async def moderate_text(text: str) -> dict:
     
     # Check offensive
     offensive = results.get("offensive", {})
-    offensive_label = offensive.get("label", "").upper()
+    offensive_label = offensive.get("label", "")
     offensive_score = offensive.get("score", 0.0)
     
-    if offensive_label in ["OFFENSIVE", "HATE", "TOXIC", "1", "LABEL_1"] and offensive_score >= settings.offensive_threshold:
+    if offensive_label in _OFFENSIVE_BAD and offensive_score >= settings.offensive_threshold:
         is_safe = False
         confidence = max(confidence, offensive_score) if not is_safe else offensive_score
         category = category or "offensive"
         reason = reason or "Content flagged as offensive/hateful"
     
-    return {
-        "isSafe": is_safe,
-        "confidence": confidence,
-        "category": category,
-        "reason": reason,
-        "details": results
-    }
+    return ModerationResult(
+        isSafe=is_safe,
+        confidence=confidence,
+        category=category,
+        reason=reason,
+        details=results
+    ), cacheable
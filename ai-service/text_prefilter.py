@@ -0,0 +1,102 @@
+"""
+ODAN AI Service - Lexicon prefilter for text moderation
+
+Most posts are benign, so one scan with a precompiled regex over a
+profanity/NSFW lexicon decides the common cases without touching a model:
+
+- no lexicon hit, no URL and short text -> safe
+- a guaranteed-unsafe term              -> unsafe ("offensive")
+- anything else                         -> ambiguous, run the models
+
+The lexicon is a plain text file with one term per line. Lines starting with
+``!`` are guaranteed-unsafe terms; ``#`` starts a comment. No lexicon
+configured means the prefilter is disabled.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PREFILTER_SAFE = "safe"
+PREFILTER_UNSAFE = "unsafe"
+
+_URL_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Lexicon:
+    """Compiled matchers for flagged and guaranteed-unsafe terms"""
+    flagged: re.Pattern | None
+    blocked: re.Pattern | None
+
+
+def _compile_terms(terms: list[str]) -> re.Pattern | None:
+    if not terms:
+        return None
+    # Longest first so overlapping terms match the most specific entry
+    alternation = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    # Lookarounds rather than \b: \b never matches at the edge of a term that
+    # starts or ends with a symbol (e.g. "a$$")
+    return re.compile(rf"(?<!\w)(?:{alternation})(?!\w)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4)
+def load_lexicon(path: str) -> Lexicon:
+    """
+    Read and compile a lexicon file
+
+    An unreadable file yields an empty lexicon (prefilter disabled); being
+    cached, the failure is logged once instead of on every request.
+    """
+    try:
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning(f"Prefilter lexicon unavailable, prefilter disabled: {e}")
+        return Lexicon(flagged=None, blocked=None)
+
+    flagged, blocked = [], []
+    for line in lines:
+        term = line.split("#", 1)[0].strip()
+        if not term:
+            continue
+        if term.startswith("!"):
+            term = term[1:].strip()
+            if term:
+                blocked.append(term)
+        else:
+            flagged.append(term)
+
+    logger.info(f"Loaded prefilter lexicon: {len(flagged)} flagged, {len(blocked)} blocked terms")
+    return Lexicon(flagged=_compile_terms(flagged), blocked=_compile_terms(blocked))
+
+
+def prefilter_text(text: str) -> str | None:
+    """
+    Classify cleaned text from the lexicon alone.
+
+    Returns PREFILTER_SAFE, PREFILTER_UNSAFE, or None when the models must decide.
+    """
+    if not settings.text_prefilter_lexicon:
+        return None
+
+    lexicon = load_lexicon(settings.text_prefilter_lexicon)
+    if lexicon.flagged is None and lexicon.blocked is None:
+        return None
+
+    if lexicon.blocked is not None and lexicon.blocked.search(text):
+        return PREFILTER_UNSAFE
+
+    if len(text) >= settings.text_prefilter_max_safe_length or _URL_PATTERN.search(text):
+        return None
+
+    if lexicon.flagged is not None and lexicon.flagged.search(text):
+        return None
+
+    return PREFILTER_SAFE